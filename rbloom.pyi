@@ -8,8 +8,9 @@ class Bloom:
     # expected_items:  max number of items to be added to the filter
     # false_positive_rate:  max false positive rate of the filter
     # hash_func:  optional argument, see section "Cryptographic security"
+    # blocked:  optional argument, see section "Blocked filters"
     def __init__(self, expected_items: int, false_positive_rate: float,
-                 hash_func=__builtins__.hash) -> None: ...
+                 hash_func=__builtins__.hash, blocked: bool = False) -> None: ...
 
     # number of buckets in the filter
     @property
@@ -19,6 +20,10 @@ class Bloom:
     @property
     def hash_func(self) -> Callable[[Any], int]: ...
 
+    # whether the filter uses the blocked layout
+    @property
+    def blocked(self) -> bool: ...
+
     # estimated number of items in the filter
     @property
     def approx_items(self) -> float: ...
@@ -37,6 +42,9 @@ class Bloom:
     # save to a bytes(), see section "Persistence"
     def save_bytes(self) -> bytes: ...
 
+    # [obj in self for obj in iterable], but faster
+    def contains_many(self, iterable: Iterable, /) -> list[bool]: ...
+
     #####################################################################
     #                    ALL SUBSEQUENT METHODS ARE                     #
     #              EQUIVALENT TO THE CORRESPONDING METHODS              #
@@ -9,22 +9,31 @@ use std::io::{Read, Write};
 use std::mem;
 use std::path::PathBuf;
 
+/// Number of queries that contains_many looks ahead to prefetch memory for
+const PREFETCH_DISTANCE: usize = 8;
+
+/// The highest bit of the k stored in a saved filter marks it as blocked
+const BLOCKED_FLAG: u64 = 1 << 63;
+
 #[pyclass(module = "rbloom")]
 #[derive(Clone)]
 struct Bloom {
     filter: BitLine,
     k: u64, // Number of hash functions (implemented via a LCG that uses
     // the original hash as a seed)
+    blocked: bool, // Whether all k bits of an item lie within one block
     hash_func: Option<Py<PyAny>>,
 }
 
 #[pymethods]
 impl Bloom {
     #[new]
+    #[pyo3(signature = (expected_items, false_positive_rate, hash_func=None, blocked=false))]
     fn new(
         expected_items: u64,
         false_positive_rate: f64,
         hash_func: Option<Bound<'_, PyAny>>,
+        blocked: bool,
     ) -> PyResult<Self> {
         // Check the inputs
         if false_positive_rate <= 0.0 || false_positive_rate >= 1.0 {
@@ -48,14 +57,34 @@ impl Bloom {
         };
 
         // Calculate the parameters for the filter
-        let size_in_bits =
+        let mut size_in_bits =
             -1.0 * (expected_items as f64) * false_positive_rate.ln() / 2.0f64.ln().powi(2);
         let k = (size_in_bits / expected_items as f64) * 2.0f64.ln();
 
+        // Confining each item to one block raises the false positive rate,
+        // so blocked filters are enlarged until the requested rate holds
+        if blocked && k >= 1.0 {
+            while blocked_false_positive_rate(expected_items as f64, size_in_bits, k as u64)
+                > false_positive_rate
+            {
+                size_in_bits *= 1.01;
+            }
+        }
+
+        // Blocked filters consist of a whole number of blocks
+        let mut size_in_bits = size_in_bits as u64;
+        if blocked {
+            size_in_bits = size_in_bits
+                .max(1)
+                .checked_next_multiple_of(lcg::BLOCK_SIZE)
+                .ok_or_else(|| PyValueError::new_err("too many bits"))?;
+        }
+
         // Create the filter
         Ok(Bloom {
-            filter: BitLine::new(size_in_bits as u64)?,
+            filter: BitLine::new(size_in_bits)?,
             k: k as u64,
+            blocked,
             hash_func,
         })
     }
@@ -66,6 +95,12 @@ impl Bloom {
         self.filter.len()
     }
 
+    /// Whether the filter uses the blocked layout, see __init__
+    #[getter]
+    fn blocked(&self) -> bool {
+        self.blocked
+    }
+
     /// Retrieve the hash_func given to __init__
     #[getter]
     fn hash_func<'py>(&self, py: Python<'py>) -> PyResult<&Bound<'py, PyAny>> {
@@ -86,7 +121,7 @@ impl Bloom {
     #[pyo3(signature = (o, /))]
     fn add(&mut self, o: &Bound<'_, PyAny>) -> PyResult<()> {
         let hash = hash(o, &self.hash_func)?;
-        for index in lcg::generate_indexes(hash, self.k, self.filter.len()) {
+        for index in self.indexes(hash) {
             self.filter.set(index);
         }
         Ok(())
@@ -118,19 +153,29 @@ impl Bloom {
 
     fn __contains__(&self, o: &Bound<'_, PyAny>) -> PyResult<bool> {
         let hash = hash(o, &self.hash_func)?;
-        for index in lcg::generate_indexes(hash, self.k, self.filter.len()) {
-            if !self.filter.get(index) {
-                return Ok(false);
-            }
-        }
-        Ok(true)
+        Ok(self.contains_hash(hash))
+    }
+
+    /// Test every item of an iterable for membership at once
+    ///
+    /// Equivalent to [o in self for o in iterable], but the bits of upcoming
+    /// items are prefetched while the current one is being tested
+    #[pyo3(signature = (iterable, /))]
+    fn contains_many(&self, iterable: &Bound<'_, PyAny>) -> PyResult<Vec<bool>> {
+        let hashes = iterable
+            .iter()?
+            .map(|o| hash(&o?, &self.hash_func))
+            .collect::<PyResult<Vec<_>>>()?;
+        Ok(self.contains_hashes(&hashes))
     }
 
     /// Return a new set with elements from the set and all others.
     #[pyo3(signature = (*others))]
     fn union(&self, others: &Bound<'_, PyTuple>) -> PyResult<Self> {
         let mut result = self.clone();
-        result.update(others)?;
+        for other in others.iter() {
+            result.update_one(&other)?;
+        }
         Ok(result)
     }
 
@@ -138,7 +183,10 @@ impl Bloom {
     #[pyo3(signature = (*others))]
     fn intersection(&self, others: &Bound<'_, PyTuple>) -> PyResult<Self> {
         let mut result = self.clone();
-        result.intersection_update(others)?;
+        let mut temp = None;
+        for other in others.iter() {
+            result.intersection_update_one(&other, &mut temp)?;
+        }
         Ok(result)
     }
 
@@ -147,13 +195,16 @@ impl Bloom {
         Ok(Bloom {
             filter: &self.filter | &other.filter,
             k: self.k,
+            blocked: self.blocked,
             hash_func: self.hash_fn_clone(py),
         })
     }
 
-    fn __ior__(&mut self, other: &Bloom) -> PyResult<()> {
-        check_compatible(self, other)?;
-        self.filter |= &other.filter;
+    fn __ior__(mut slf: PyRefMut<'_, Self>, other: &Bound<'_, Bloom>) -> PyResult<()> {
+        // A filter combined with itself stays the same
+        if other.as_ptr() != slf.as_ptr() {
+            slf.union_with(&other.try_borrow()?)?;
+        }
         Ok(())
     }
 
@@ -162,52 +213,41 @@ impl Bloom {
         Ok(Bloom {
             filter: &self.filter & &other.filter,
             k: self.k,
+            blocked: self.blocked,
             hash_func: self.hash_fn_clone(py),
         })
     }
 
-    fn __iand__(&mut self, other: &Bloom) -> PyResult<()> {
-        check_compatible(self, other)?;
-        self.filter &= &other.filter;
+    fn __iand__(mut slf: PyRefMut<'_, Self>, other: &Bound<'_, Bloom>) -> PyResult<()> {
+        if other.as_ptr() != slf.as_ptr() {
+            slf.intersect_with(&other.try_borrow()?)?;
+        }
         Ok(())
     }
 
     #[pyo3(signature = (*others))]
-    fn update(&mut self, others: &Bound<'_, PyTuple>) -> PyResult<()> {
+    fn update(mut slf: PyRefMut<'_, Self>, others: &Bound<'_, PyTuple>) -> PyResult<()> {
+        let this = slf.as_ptr();
         for other in others.iter() {
-            // If the other object is a Bloom, use the bitwise union
-            if let Ok(other) = other.downcast::<Bloom>() {
-                let other = other.try_borrow()?;
-                self.__ior__(&other)?;
-            }
-            // Otherwise, iterate over the other object and add each item
-            else {
-                for obj in other.iter()? {
-                    self.add(&obj?)?;
-                }
+            // A filter combined with itself stays the same
+            if other.as_ptr() != this {
+                slf.update_one(&other)?;
             }
         }
         Ok(())
     }
 
     #[pyo3(signature = (*others))]
-    fn intersection_update(&mut self, others: &Bound<'_, PyTuple>) -> PyResult<()> {
+    fn intersection_update(
+        mut slf: PyRefMut<'_, Self>,
+        others: &Bound<'_, PyTuple>,
+    ) -> PyResult<()> {
+        let this = slf.as_ptr();
         // Lazily allocated temp bitset
-        let mut temp: Option<Self> = None;
+        let mut temp = None;
         for other in others.iter() {
-            // If the other object is a Bloom, use the bitwise intersection
-            if let Ok(other) = other.downcast::<Bloom>() {
-                let other = other.try_borrow()?;
-                self.__iand__(&other)?;
-            }
-            // Otherwise, iterate over the other object and add each item
-            else {
-                let temp = temp.get_or_insert_with(|| self.clone());
-                temp.clear();
-                for obj in other.iter()? {
-                    temp.add(&obj?)?;
-                }
-                self.__iand__(temp)?;
+            if other.as_ptr() != this {
+                slf.intersection_update_one(&other, &mut temp)?;
             }
         }
         Ok(())
@@ -273,13 +313,15 @@ impl Bloom {
 
         let mut k_bytes = [0; mem::size_of::<u64>()];
         file.read_exact(&mut k_bytes)?;
-        let k = u64::from_le_bytes(k_bytes);
+        let (k, blocked) = from_header(u64::from_le_bytes(k_bytes));
 
         let filter = BitLine::load(&mut file)?;
+        check_block_size(&filter, blocked)?;
 
         Ok(Bloom {
             filter,
             k,
+            blocked,
             hash_func,
         })
     }
@@ -306,13 +348,15 @@ impl Bloom {
         let k_bytes: [u8; mem::size_of::<u64>()] = bytes[0..mem::size_of::<u64>()]
             .try_into()
             .expect("slice with incorrect length");
-        let k = u64::from_le_bytes(k_bytes);
+        let (k, blocked) = from_header(u64::from_le_bytes(k_bytes));
 
         let filter = BitLine::load_bytes(&bytes[mem::size_of::<u64>()..])?;
+        check_block_size(&filter, blocked)?;
 
         Ok(Bloom {
             filter,
             k,
+            blocked,
             hash_func,
         })
     }
@@ -325,7 +369,7 @@ impl Bloom {
             ));
         }
         let mut file = File::create(filepath)?;
-        file.write_all(&self.k.to_le_bytes())?;
+        file.write_all(&self.header().to_le_bytes())?;
         self.filter.save(&mut file)?;
         Ok(())
     }
@@ -339,10 +383,10 @@ impl Bloom {
             ));
         }
 
-        debug_assert_eq!(K_SIZE, self.k.to_le_bytes().len());
+        debug_assert_eq!(K_SIZE, self.header().to_le_bytes().len());
         let len = K_SIZE + self.filter.bits().len();
         PyBytes::new_bound_with(py, len, |data| {
-            data[..K_SIZE].copy_from_slice(&self.k.to_le_bytes());
+            data[..K_SIZE].copy_from_slice(&self.header().to_le_bytes());
             data[K_SIZE..].copy_from_slice(self.filter.bits());
             Ok(())
         })
@@ -360,10 +404,94 @@ impl Bloom {
         self.hash_func.as_ref().map(|f| f.clone_ref(py))
     }
 
+    fn indexes(&self, hash: i128) -> impl Iterator<Item = u64> {
+        lcg::generate_indexes(hash, self.k, self.filter.len(), self.blocked)
+    }
+
+    /// Add every item of an iterable. The GIL is held throughout, as this
+    /// borrows the filter mutably and releasing the GIL would let other
+    /// threads run into that borrow.
+    fn add_all(&mut self, iterable: &Bound<'_, PyAny>) -> PyResult<()> {
+        for obj in iterable.iter()? {
+            self.add(&obj?)?;
+        }
+        Ok(())
+    }
+
+    /// k with the blocked flag folded in, as stored by save and save_bytes
+    fn header(&self) -> u64 {
+        if self.blocked {
+            self.k | BLOCKED_FLAG
+        } else {
+            self.k
+        }
+    }
+
+    fn contains_hash(&self, hash: i128) -> bool {
+        self.indexes(hash).all(|index| self.filter.get(index))
+    }
+
+    fn contains_hashes(&self, hashes: &[i128]) -> Vec<bool> {
+        hashes
+            .iter()
+            .enumerate()
+            .map(|(i, &hash)| {
+                if let Some(&upcoming) = hashes.get(i + PREFETCH_DISTANCE) {
+                    for index in self.indexes(upcoming) {
+                        self.filter.prefetch(index);
+                    }
+                }
+                self.contains_hash(hash)
+            })
+            .collect()
+    }
+
+    fn union_with(&mut self, other: &Bloom) -> PyResult<()> {
+        check_compatible(self, other)?;
+        self.filter |= &other.filter;
+        Ok(())
+    }
+
+    fn intersect_with(&mut self, other: &Bloom) -> PyResult<()> {
+        check_compatible(self, other)?;
+        self.filter &= &other.filter;
+        Ok(())
+    }
+
+    fn update_one(&mut self, other: &Bound<'_, PyAny>) -> PyResult<()> {
+        // If the other object is a Bloom, use the bitwise union
+        if let Ok(other) = other.downcast::<Bloom>() {
+            self.union_with(&other.try_borrow()?)
+        }
+        // Otherwise, iterate over the other object and add each item
+        else {
+            self.add_all(other)
+        }
+    }
+
+    fn intersection_update_one(
+        &mut self,
+        other: &Bound<'_, PyAny>,
+        temp: &mut Option<Bloom>,
+    ) -> PyResult<()> {
+        // If the other object is a Bloom, use the bitwise intersection
+        if let Ok(other) = other.downcast::<Bloom>() {
+            self.intersect_with(&other.try_borrow()?)
+        }
+        // Otherwise, iterate over the other object and add each item
+        else {
+            let temp = temp.get_or_insert_with(|| self.clone());
+            temp.clear();
+            temp.add_all(other)?;
+            self.intersect_with(temp)
+        }
+    }
+
     fn zeroed_clone(&self, py: Python<'_>) -> Bloom {
         Bloom {
             filter: BitLine::new(self.filter.len()).unwrap(),
             k: self.k,
+            blocked: self.blocked,
             hash_func: self.hash_fn_clone(py),
         }
     }
@@ -382,9 +510,7 @@ impl Bloom {
             }
             Err(_) => {
                 let mut other_bloom = self.zeroed_clone(other.py());
-                for obj in other.iter()? {
-                    other_bloom.add(&obj?)?;
-                }
+                other_bloom.add_all(other)?;
                 f(&other_bloom)
             }
         }
@@ -411,6 +537,8 @@ mod bitline {
         Some((q.try_into().ok()?, r.try_into().ok()?))
     }
 
+    // The derived equality compares the byte slices with memcmp, which is
+    // already vectorized by the platform's libc
     #[derive(Clone, PartialEq, Eq)]
     pub struct BitLine {
         bits: Box<[u8]>,
@@ -441,6 +569,22 @@ mod bitline {
             self.bits[idx] & (1 << offset) != 0
         }
 
+        /// Hint the CPU to start loading the byte containing index into the
+        /// cache. Make sure that index is less than len when calling this!
+        #[inline(always)]
+        pub fn prefetch(&self, index: u64) {
+            #[cfg(target_arch = "x86_64")]
+            {
+                use std::arch::x86_64::{_mm_prefetch, _MM_HINT_T0};
+                let (idx, _) = bit_idx(index).unwrap();
+                let ptr = &self.bits[idx] as *const u8 as *const i8;
+                // Prefetching is only a hint and never faults
+                unsafe { _mm_prefetch::<_MM_HINT_T0>(ptr) }
+            }
+            #[cfg(not(target_arch = "x86_64"))]
+            let _ = index;
+        }
+
         /// Returns the number of bits in the BitLine
         pub fn len(&self) -> u64 {
             self.bits.len() as u64 * 8
@@ -455,7 +599,7 @@ mod bitline {
         }
 
         pub fn is_empty(&self) -> bool {
-            self.bits.iter().all(|&word| word == 0)
+            self.bits.chunks(8).all(|chunk| word(chunk) == 0)
         }
 
         pub fn is_subset(&self, other: &BitLine) -> bool {
@@ -501,11 +645,45 @@ mod bitline {
         }
     }
 
-    fn all_pairs(lhs: &BitLine, rhs: &BitLine, mut f: impl FnMut(u8, u8) -> bool) -> bool {
-        lhs.bits
-            .iter()
-            .zip(rhs.bits.iter())
-            .all(move |(&lhs, &rhs)| f(lhs, rhs))
+    /// Reads up to 8 bytes as a little-endian word, padding with zeros
+    #[inline(always)]
+    fn word(bytes: &[u8]) -> u64 {
+        let mut buf = [0; 8];
+        buf[..bytes.len()].copy_from_slice(bytes);
+        u64::from_le_bytes(buf)
+    }
+
+    /// Compares a word at a time rather than a byte at a time; a zero-padded
+    /// trailing word is passed to f last if the length isn't a multiple of 8
+    fn all_pairs(lhs: &BitLine, rhs: &BitLine, mut f: impl FnMut(u64, u64) -> bool) -> bool {
+        let (lhs, rhs) = (lhs.bits.chunks_exact(8), rhs.bits.chunks_exact(8));
+        let (lhs_tail, rhs_tail) = (word(lhs.remainder()), word(rhs.remainder()));
+        lhs.zip(rhs).all(|(lhs, rhs)| f(word(lhs), word(rhs))) && f(lhs_tail, rhs_tail)
+    }
+
+    /// Applies f to each byte of lhs and the corresponding byte of rhs. LLVM
+    /// vectorizes the loop for the baseline target; on x86_64 CPUs that
+    /// support AVX2, a second copy compiled for 256-bit registers is used.
+    fn zip_apply(lhs: &mut [u8], rhs: &[u8], f: impl Fn(&mut u8, u8)) {
+        #[cfg(target_arch = "x86_64")]
+        if is_x86_feature_detected!("avx2") {
+            // Safe because the CPU has just been checked to support AVX2
+            return unsafe { zip_apply_avx2(lhs, rhs, f) };
+        }
+        zip_apply_generic(lhs, rhs, f)
+    }
+
+    #[inline(always)]
+    fn zip_apply_generic(lhs: &mut [u8], rhs: &[u8], f: impl Fn(&mut u8, u8)) {
+        for (lhs, &rhs) in lhs.iter_mut().zip(rhs) {
+            f(lhs, rhs);
+        }
+    }
+
+    #[cfg(target_arch = "x86_64")]
+    #[target_feature(enable = "avx2")]
+    unsafe fn zip_apply_avx2(lhs: &mut [u8], rhs: &[u8], f: impl Fn(&mut u8, u8)) {
+        zip_apply_generic(lhs, rhs, f)
     }
 
     impl std::ops::BitAnd for BitLine {
@@ -534,9 +712,7 @@ mod bitline {
     }
     impl std::ops::BitAndAssign<&BitLine> for BitLine {
         fn bitand_assign(&mut self, rhs: &Self) {
-            for (lhs, rhs) in self.bits.iter_mut().zip(rhs.bits.iter()) {
-                *lhs &= rhs;
-            }
+            zip_apply(&mut self.bits, &rhs.bits, |lhs, rhs| *lhs &= rhs);
         }
     }
 
@@ -567,9 +743,7 @@ mod bitline {
 
     impl std::ops::BitOrAssign<&BitLine> for BitLine {
         fn bitor_assign(&mut self, rhs: &Self) {
-            for (lhs, rhs) in self.bits.iter_mut().zip(rhs.bits.iter()) {
-                *lhs |= rhs;
-            }
+            zip_apply(&mut self.bits, &rhs.bits, |lhs, rhs| *lhs |= rhs);
         }
     }
 }
@@ -599,10 +773,26 @@ mod lcg {
         }
     }
 
-    pub fn generate_indexes(hash: i128, k: u64, len: u64) -> impl Iterator<Item = u64> {
-        distribute_entropy(hash)
-            .take(k as usize)
-            .map(move |x: u64| x % len)
+    /// Number of bits per block in a blocked filter (one 64-byte cache line)
+    pub const BLOCK_SIZE: u64 = 512;
+
+    /// In a blocked filter, the first number picks the block and the
+    /// indexes are all confined to it, so that a lookup touches only a
+    /// single cache line instead of k of them.
+    pub fn generate_indexes(
+        hash: i128,
+        k: u64,
+        len: u64,
+        blocked: bool,
+    ) -> impl Iterator<Item = u64> {
+        let mut random = distribute_entropy(hash);
+        let (start, span) = if blocked {
+            let block = random.next().unwrap() % (len / BLOCK_SIZE);
+            (block * BLOCK_SIZE, BLOCK_SIZE)
+        } else {
+            (0, len)
+        };
+        random.take(k as usize).map(move |x: u64| start + x % span)
     }
 }
 
@@ -617,7 +807,47 @@ fn hash(o: &Bound<'_, PyAny>, hash_func: &Option<Py<PyAny>>) -> PyResult<i128> {
     }
 }
 
+/// Split a stored k into the actual k and the blocked flag
+fn from_header(header: u64) -> (u64, bool) {
+    (header & !BLOCKED_FLAG, header & BLOCKED_FLAG != 0)
+}
+
+/// Expected false positive rate of a blocked filter. The number of items
+/// that land in a block is Poisson distributed, and each block then acts
+/// like a small standard filter of BLOCK_SIZE bits.
+fn blocked_false_positive_rate(expected_items: f64, size_in_bits: f64, k: u64) -> f64 {
+    let block = lcg::BLOCK_SIZE as f64;
+    let lambda = expected_items * block / size_in_bits;
+    let mut probability = (-lambda).exp(); // of a block holding i items
+    let mut rate = 0.0;
+    let mut i = 0.0;
+    loop {
+        let bit_set = 1.0 - (1.0 - 1.0 / block).powf(k as f64 * i);
+        rate += probability * bit_set.powf(k as f64);
+        i += 1.0;
+        probability *= lambda / i;
+        if i > lambda && probability < 1e-18 {
+            return rate;
+        }
+    }
+}
+
+/// Blocked filters must consist of a non-zero whole number of blocks
+fn check_block_size(filter: &BitLine, blocked: bool) -> PyResult<()> {
+    if blocked && (filter.len() == 0 || filter.len() % lcg::BLOCK_SIZE != 0) {
+        return Err(PyValueError::new_err(
+            "size of a blocked filter must be a non-zero multiple of 512 bits",
+        ));
+    }
+    Ok(())
+}
+
 fn check_compatible(a: &Bloom, b: &Bloom) -> PyResult<()> {
+    if a.blocked != b.blocked {
+        return Err(PyValueError::new_err(
+            "Bloom filters must either both be blocked or both not be blocked",
+        ));
+    }
     if a.k != b.k || a.filter.len() != b.filter.len() {
         return Err(PyValueError::new_err(
             "size and max false positive rate must be the same for both filters",
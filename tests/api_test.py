@@ -1,11 +1,15 @@
 #!/usr/bin/env python3
 import gc
 import weakref
+from concurrent.futures import ThreadPoolExecutor
 
 from rbloom import Bloom
 from hashlib import sha256
 from pickle import dumps
+from functools import singledispatch
+from struct import pack
 import os
+import tempfile
 
 
 def test_bloom(bloom: Bloom):
@@ -21,6 +25,7 @@ def test_bloom(bloom: Bloom):
     assert 'foo' in bloom
     assert 'bar' in bloom
     assert 'baz' not in bloom
+    assert bloom.contains_many(['foo', 'bar', 'baz']) == [True, True, False]
 
     bloom.update(['baz', 'qux'])
     assert 'baz' in bloom
@@ -37,9 +42,9 @@ def test_bloom(bloom: Bloom):
     other.update(['foo', 'bar', 'baz', 'qux'])
     assert other == bloom
 
-    other.update(str(i).encode()*500 for i in range(100000))
-    for i in range(100000):
-        assert str(i).encode()*500 in other
+    keys = [i.to_bytes(8, 'little') for i in range(100000)]
+    other.update(keys)
+    assert all(other.contains_many(keys))
     assert bloom != other
     assert bloom & other == bloom
     assert bloom | other == other
@@ -74,11 +79,9 @@ def test_bloom(bloom: Bloom):
 
     # TEST PERSISTENCE
     if not bloom.hash_func is hash:
-        # find a filename that doesn't exist
-        i = 0
-        while os.path.exists(f'UNIT_TEST_{i}.bloom'):
-            i += 1
-        filename = f'test{i}.bloom'
+        # reserve a unique filename
+        with tempfile.NamedTemporaryFile(suffix='.bloom', delete=False) as f:
+            filename = f.name
 
         try:
             # save and load
@@ -96,9 +99,53 @@ def test_bloom(bloom: Bloom):
         assert bloom == bloom3
 
 
+def test_self_update(bloom: Bloom):
+    bloom.update(['foo', 'bar'])
+    orig = bloom.copy()
+
+    bloom.update(bloom)
+    assert bloom == orig
+    bloom.intersection_update(bloom)
+    assert bloom == orig
+    bloom |= bloom
+    assert bloom == orig
+    bloom &= bloom
+    assert bloom == orig
+    assert bloom.union(bloom) == orig
+    assert bloom.intersection(bloom) == orig
+
+
+# common types are serialized directly, skipping the pickling overhead; the
+# one-byte type tags keep e.g. 97, 'a' and b'a' apart, like pickle does
+@singledispatch
+def to_bytes(obj):
+    return dumps(obj)
+
+
+@to_bytes.register(bytes)
+@to_bytes.register(bytearray)
+def _(obj):
+    return b'b' + obj
+
+
+@to_bytes.register(str)
+def _(obj):
+    return b's' + obj.encode('utf-8', 'surrogatepass')
+
+
+@to_bytes.register(int)
+def _(obj):
+    return b'i' + obj.to_bytes(obj.bit_length() // 8 + 1, "big", signed=True)
+
+
+@to_bytes.register(float)
+def _(obj):
+    return b'f' + pack("<d", obj)
+
+
 def sha_based(obj):
-    h = sha256(dumps(obj)).digest()
-    return int.from_bytes(h[:16], "big") - 2**127
+    h = sha256(to_bytes(obj)).digest()
+    return int.from_bytes(memoryview(h)[:16], "big", signed=True)
 
 
 def circular_ref():
@@ -114,17 +161,77 @@ def circular_ref():
     assert weak_ref() is None
 
 
+def shared_threaded_update():
+    # one filter used from several threads at once must never raise
+    # "Already borrowed", which would happen if the GIL were released
+    # while a method holds a borrow of the filter
+    bloom = Bloom(400000, 0.01)
+    chunks = [[f'{t}-{i}' for i in range(100000)] for t in range(4)]
+
+    def work(keys):
+        bloom.update(keys)
+        for key in keys:
+            assert key in bloom
+        assert all(bloom.contains_many(keys))
+        assert bloom.issuperset(keys)
+
+    with ThreadPoolExecutor() as executor:
+        list(executor.map(work, chunks))
+    for keys in chunks:
+        for key in keys:
+            assert key in bloom
+
+
+def blocked_layout():
+    # all bits of an item must lie within one 64-byte block
+    bloom = Bloom(100000, 0.01, hash_func=sha_based, blocked=True)
+    bloom.add('foo')
+    bits = bloom.save_bytes()[8:]
+    set_bytes = [i for i, byte in enumerate(bits) if byte]
+    start = set_bytes[0] // 64 * 64
+    assert set_bytes[-1] < start + 64
+
+    try:
+        bloom |= Bloom(100000, 0.01, hash_func=sha_based)
+    except ValueError as e:
+        assert 'blocked' in str(e)
+    else:
+        assert False, 'combining blocked and unblocked filters should fail'
+
+
+def invalid_blocked_load():
+    # blocked header (top bit of k set) followed by a partial block
+    data = (3 | 1 << 63).to_bytes(8, 'little') + bytes(8)
+    try:
+        Bloom.load_bytes(data, sha_based)
+    except ValueError:
+        pass
+    else:
+        assert False, 'loading a truncated blocked filter should fail'
+
+
 def api_suite():
     assert repr(Bloom(27_000, 0.0317)) == "<Bloom size_in_bits=193960 approx_items=0.0>"
     assert Bloom(1140, 0.999).hash_func == hash
     assert Bloom(102, 0.01, hash_func=hash).hash_func is hash
     assert Bloom(103100, 0.51, hash_func=sha_based).hash_func is sha_based
+    assert not Bloom(27_000, 0.0317).blocked
+    blocked = Bloom(27_000, 0.0317, blocked=True)
+    assert blocked.size_in_bits % 512 == 0
+    assert blocked.size_in_bits > Bloom(27_000, 0.0317).size_in_bits
 
     test_bloom(Bloom(13242, 0.0000001))
     test_bloom(Bloom(9874124, 0.01, hash_func=sha_based))
     test_bloom(Bloom(2837, 0.5, hash_func=hash))
+    test_bloom(Bloom(13242, 0.0000001, blocked=True))
+    test_bloom(Bloom(185422, 0.01, hash_func=sha_based, blocked=True))
+    test_self_update(Bloom(1000, 0.01))
+    test_self_update(Bloom(1000, 0.01, hash_func=sha_based))
 
     circular_ref()
+    shared_threaded_update()
+    blocked_layout()
+    invalid_blocked_load()
 
     print('All API tests passed')
 
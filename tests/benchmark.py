@@ -3,52 +3,56 @@ import timeit
 import time
 
 NUMBER = 1000000
+REPEAT = 20
+
+# Objects with increasingly expensive built-in hashes: object() hashes its
+# address, small ints hash as themselves, large ints go through the full
+# int hash and bytes are hashed with SipHash
+OBJECTS = [
+    ("object()", f"[object() for _ in range({NUMBER})]"),
+    ("small int", f"list(range({NUMBER}))"),
+    ("random int", f"[random.randint(0, 2**63) for _ in range({NUMBER})]"),
+    ("32 bytes", f"[os.urandom(32) for _ in range({NUMBER})]"),
+]
+
+# (label, statement, whether the objects are already in the filter)
+OPERATIONS = [
+    ("add", "for o in objects: b.add(o)", False),
+    ("update", "b.update(objects)", False),
+    ("update(iter)", "b.update(o for o in objects)", False),
+    ("in", "for o in objects: o in b", True),
+    ("contains_many", "b.contains_many(objects)", True),
+]
 
 
 def format_time(time_ns: float) -> str:
     return f"{time_ns / 1000:.04} us"
 
 
-def main():
-    res = timeit.timeit(
-        setup=f"from rbloom import Bloom; b = Bloom({NUMBER}, 0.01)",
-        stmt="b.add(object())",
-        timer=time.perf_counter_ns,
-        number=NUMBER,
-    )
-    print("Time to insert an element:")
-    print(format_time(res / NUMBER))
-
+def measure(objects: str, stmt: str, prefill: bool) -> float:
+    setup = f"import os, random; from rbloom import Bloom; b = Bloom({NUMBER}, 0.01); objects = {objects}"
+    if prefill:
+        setup += "; b.update(objects)"
     results = timeit.repeat(
-        setup=f"from rbloom import Bloom; b = Bloom({NUMBER}, 0.01); objects = [object() for _ in range({NUMBER})]",
-        stmt="b.update(objects)",
+        setup=setup,
+        stmt=stmt,
         timer=time.perf_counter_ns,
         number=1,
-        repeat=20,
+        repeat=REPEAT + 1,
     )
-    res = min(results)
-    print("Time to insert each element in a batch:")
-    print(format_time(res / NUMBER))
+    # setup runs again before every repeat, so each run gets a fresh filter;
+    # the first run is still discarded, as it is slowed down by cold
+    # instruction caches and branch predictors and by the interpreter
+    # specializing the timed code
+    return min(results[1:]) / NUMBER
 
-    results = timeit.repeat(
-        setup=f"from rbloom import Bloom; b = Bloom({NUMBER}, 0.01); objects = (object() for _ in range({NUMBER}))",
-        stmt="b.update(objects)",
-        timer=time.perf_counter_ns,
-        number=1,
-        repeat=20,
-    )
-    res = min(results)
-    print("Time to insert each element in a batch via an iterable:")
-    print(format_time(res / NUMBER))
 
-    res = timeit.timeit(
-        setup=f"from rbloom import Bloom; b = Bloom({NUMBER}, 0.01); stored_obj = object(); b.add(stored_obj); b.update(object() for _ in range({NUMBER}))",
-        stmt="stored_obj in b",
-        timer=time.perf_counter_ns,
-        number=NUMBER,
-    )
-    print("Time to check if an object is present:")
-    print(format_time(res / NUMBER))
+def main():
+    print("Time per element:")
+    print(f"{'':<12}" + "".join(f"{label:>15}" for label, _, _ in OPERATIONS))
+    for name, objects in OBJECTS:
+        row = [measure(objects, stmt, prefill) for _, stmt, prefill in OPERATIONS]
+        print(f"{name:<12}" + "".join(f"{format_time(t):>15}" for t in row))
 
 
 if __name__ == "__main__":
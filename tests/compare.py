@@ -0,0 +1,70 @@
+import statistics
+import struct
+import timeit
+
+from rbloom import Bloom
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+NUM_ITEMS = 10_000_000
+FALSE_POSITIVE_RATE = 0.01
+REPEAT = 5
+
+
+def run(ty: str):
+    bf = Bloom(NUM_ITEMS, FALSE_POSITIVE_RATE)
+
+    if ty == "add":
+        for i in range(NUM_ITEMS):
+            bf.add(i + 0.5)  # floats because ints are hashed as themselves
+    else:
+        bf.update(i + 0.5 for i in range(NUM_ITEMS))
+
+    assert all(i + 0.5 in bf for i in range(NUM_ITEMS))
+
+
+def run_bytes(ty: str, items: list):
+    bf = Bloom(NUM_ITEMS, FALSE_POSITIVE_RATE)
+
+    if ty == "add":
+        for x in items:
+            bf.add(x)
+    else:
+        bf.update(items)
+
+    assert all(x in bf for x in items)
+
+
+def run_array(array):
+    bf = Bloom(NUM_ITEMS, FALSE_POSITIVE_RATE)
+    bf.update(array)  # NumPy floats hash the same as Python floats
+    assert all(bf.contains_many(array))
+
+
+def report(name: str, func):
+    # the first run is discarded, as it is slowed down by cold caches and
+    # branch predictors and by the interpreter specializing the hot loops
+    results = timeit.repeat(func, number=1, repeat=REPEAT + 1)[1:]
+    best = min(results)
+    median = statistics.median(results)
+    print(f"{name}: {best:.03f} s (median {median:.03f} s)")
+
+
+def main():
+    # packed once up front so that the timings don't include struct.pack
+    items = [struct.pack("d", i + 0.5) for i in range(NUM_ITEMS)]
+
+    for ty in ("add", "update"):
+        report(f"run via .{ty}", lambda: run(ty))
+        report(f"run_bytes via .{ty}", lambda: run_bytes(ty, items))
+
+    if np is not None:
+        array = np.arange(NUM_ITEMS, dtype=np.float64) + 0.5
+        report("run_array via .update", lambda: run_array(array))
+
+
+if __name__ == "__main__":
+    main()